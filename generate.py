@@ -1,5 +1,7 @@
 import sys
 
+from collections import deque
+
 from crossword import *
 
 
@@ -11,9 +13,30 @@ class CrosswordCreator():
         """
         self.crossword = crossword
         self.domains = {
-            var: self.crossword.words.copy()
+            var: self.crossword.words
+            for var in self.crossword.variables
+        }
+        # Vocabulary grouped by word length, used for node consistency
+        self._by_len = {}
+        for word in self.crossword.words:
+            self._by_len.setdefault(len(word), set()).add(word)
+        # Variables not yet part of the assignment being searched
+        self._unassigned = set(self.crossword.variables)
+        # Neighbors and non-empty overlaps of each variable, computed once
+        self._nbrs = {
+            var: frozenset(self.crossword.neighbors(var))
             for var in self.crossword.variables
         }
+        self._overlap = {
+            arc: overlap
+            for arc, overlap in self.crossword.overlaps.items()
+            if overlap
+        }
+        # Number of neighbors of each variable, used to break MRV ties
+        self._deg = {var: len(self._nbrs[var]) for var in self._nbrs}
+        # Words of each domain grouped by the letter at a given index,
+        # keyed by (var, index); rebuilt lazily when a domain shrinks
+        self.buckets = {}
         
     def letter_grid(self, assignment):
         """
@@ -35,14 +58,14 @@ class CrosswordCreator():
         """
         Print crossword assignment to the terminal.
         """
-        letters = self.letter_grid(assignment)
-        for i in range(self.crossword.height):
-            for j in range(self.crossword.width):
-                if self.crossword.structure[i][j]:
-                    print(letters[i][j] or " ", end="")
-                else:
-                    print("█", end="")
-            print()
+        rows = [
+            ["█" if not cell else " " for cell in row]
+            for row in self.crossword.structure
+        ]
+        for variable, word in assignment.items():
+            for (i, j), letter in zip(variable.cells, word):
+                rows[i][j] = letter
+        sys.stdout.write("".join("".join(row) + "\n" for row in rows))
 
     def save(self, assignment, filename):
         """
@@ -64,6 +87,13 @@ class CrosswordCreator():
         font = ImageFont.truetype("assets/fonts/OpenSans-Regular.ttf", 80)
         draw = ImageDraw.Draw(img)
 
+        # Measure each distinct letter once
+        used = {letter for row in letters for letter in row if letter}
+        sizes = {
+            letter: draw.textbbox((0, 0), letter, font=font)
+            for letter in used
+        }
+
         for i in range(self.crossword.height):
             for j in range(self.crossword.width):
 
@@ -76,10 +106,13 @@ class CrosswordCreator():
                 if self.crossword.structure[i][j]:
                     draw.rectangle(rect, fill="white")
                     if letters[i][j]:
-                        w, h = draw.textsize(letters[i][j], font=font)
+                        left, top, right, bottom = sizes[letters[i][j]]
+                        w, h = right - left, bottom - top
+                        # textbbox is offset from the origin by
+                        # (left, top); subtract it to center the glyph
                         draw.text(
-                            (rect[0][0] + ((interior_size - w) / 2),
-                             rect[0][1] + ((interior_size - h) / 2) - 10),
+                            (rect[0][0] + ((interior_size - w) / 2) - left,
+                             rect[0][1] + ((interior_size - h) / 2) - top),
                             letters[i][j], fill="black", font=font
                         )
 
@@ -90,7 +123,8 @@ class CrosswordCreator():
         Enforce node and arc consistency, and then solve the CSP.
         """
         self.enforce_node_consistency()
-        self.ac3()
+        if not self.ac3():
+            return None
         return self.backtrack(dict())
 
     def enforce_node_consistency(self):
@@ -99,10 +133,35 @@ class CrosswordCreator():
         (Remove any values that are inconsistent with a variable's unary
          constraints; in this case, the length of the word.)
         """
-        for var,domain in self.domains.items():
-            self.domains[var]=set([dom for dom in list(domain) if len(dom)==var.length])
+        for var in self.domains:
+            self.domains[var]=set(self._by_len.get(var.length,()))
+            self.invalidate_buckets(var)
         return None
 
+    def bucket(self, var, index):
+        """
+        Return a dict mapping each letter to the set of words in
+        `self.domains[var]` having that letter at position `index`.
+        """
+        key=(var,index)
+        if key not in self.buckets:
+            grupos={}
+            for word in self.domains[var]:
+                grupos.setdefault(word[index],set()).add(word)
+            self.buckets[key]=grupos
+        return self.buckets[key]
+
+    def invalidate_buckets(self, var):
+        """
+        Discard the cached letter buckets of `var` after its domain changed.
+        Return the discarded buckets, keyed as in `self.buckets`.
+        """
+        descartados={}
+        for index in range(var.length):
+            if (var,index) in self.buckets:
+                descartados[var,index]=self.buckets.pop((var,index))
+        return descartados
+
     def revise(self, x, y):
         """
         
@@ -113,17 +172,23 @@ class CrosswordCreator():
         Return True if a revision was made to the domain of `x`; return
         False if no revision was made.
         """
-        xOriginal=self.domains[x].copy()
-        yOverlap=self.crossword.overlaps[y,x][0]
-        xOverlap=self.crossword.overlaps[y,x][1]
-        auxiliar=set()
-        for domY in self.domains[y]:
-            res=[domX for domX in list(self.domains[x]) if domX[xOverlap]==domY[yOverlap]]
-            if domY in res:
-                res.remove(domY)
-            auxiliar=auxiliar.union(set(res).difference(auxiliar))
+        xOriginal=self.domains[x]
+        xOverlap,yOverlap=self._overlap[x,y]
+        bucketX=self.bucket(x,xOverlap)
+        bucketY=self.bucket(y,yOverlap)
+        letras=bucketX.keys() & bucketY.keys()
+        auxiliar=set().union(*(bucketX[c] for c in letras))
+        # A word cannot be its own support: drop those only matched by itself
+        # (only words present in both domains can be in that situation)
+        for domX in auxiliar.intersection(self.domains[y]):
+            soporte=bucketY[domX[xOverlap]]
+            if len(soporte)==1 and domX in soporte:
+                auxiliar.remove(domX)
+        if len(auxiliar)==len(xOriginal):
+            return False
         self.domains[x]=auxiliar
-        return len(xOriginal)!=self.domains[x]
+        self.invalidate_buckets(x)
+        return True
 
     def ac3(self, arcs=None):
         """
@@ -134,19 +199,22 @@ class CrosswordCreator():
         Return True if arc consistency is enforced and no domains are empty;
         return False if one or more domains end up empty.
         """
-        quee=[]
-        for var in self.crossword.variables:
-            for vecino in list(self.crossword.neighbors(var)):
-                quee.append((vecino,var))
-        while len(quee)!=0:
-            q=quee.pop(0)
+        if arcs is None:
+            arcs=self._overlap.keys()
+        # Arcs without an overlap impose no constraint; skip them and never
+        # queue an arc that is already waiting to be revised
+        queue=deque(arc for arc in dict.fromkeys(arcs) if arc in self._overlap)
+        enCola=set(queue)
+        while queue:
+            q=queue.popleft()
+            enCola.discard(q)
             if (self.revise(q[0],q[1])):
-                if (self.domains[q[0]]==0):
+                if not self.domains[q[0]]:
                     return False
-                vecinos=self.crossword.neighbors(q[0])
-                vecinos.remove(q[1])
-                for vecino in list(vecinos):
-                    quee.append((vecino,q[0]))
+                for vecino in self._nbrs[q[0]]-{q[1]}:
+                    if (vecino,q[0]) not in enCola:
+                        enCola.add((vecino,q[0]))
+                        queue.append((vecino,q[0]))
         return True
 
     def assignment_complete(self, assignment):
@@ -161,19 +229,16 @@ class CrosswordCreator():
         Return True if `assignment` is consistent (i.e., words fit in crossword
         puzzle without conflicting characters); return False otherwise.
         """
-        consisten=True
-        assignVec=set(assignment.keys())
         for var,word in assignment.items():
-            if var.length==len(word):
-                vecinos=set(self.crossword.neighbors(var)).intersection(assignVec)
-                for vecino in list(vecinos):
-                    overlap=self.crossword.overlaps[(var,vecino)]
-                    if word[overlap[0]]!=assignment[vecino][overlap[1]]:
-                        consisten=False
-            else:
-                consistent=False
-
-        return consisten
+            if var.length!=len(word):
+                return False
+            for vecino in self._nbrs[var]:
+                if vecino not in assignment:
+                    continue
+                overlap=self._overlap[var,vecino]
+                if word[overlap[0]]!=assignment[vecino][overlap[1]]:
+                    return False
+        return True
 
     def order_domain_values(self, var, assignment):
         """
@@ -182,20 +247,26 @@ class CrosswordCreator():
         The first value in the list, for example, should be the one
         that rules out the fewest values among the neighbors of `var`.
         """
-        domOriginal=self.domains[var].copy()
-        vecinos=self.crossword.neighbors(var)
-        knownVecinos=set(assignment.keys()).intersection_update(vecinos)
-        arcDomains={dom:0 for dom in list(self.domains[var])}
-        if knownVecinos:
-            for vecino in list(knownVecinos):
-                self.domains[var]=domOriginal
-                self.revise(var,vecino)
-                for dom in self.domains[var]:
-                    if dom in domOriginal:
-                        arcDomains[dom]=arcDomains[dom]+1
-            return list(arcDomains.keys()).sort()
-        else:
-            return list(domOriginal)
+        vecinos=[
+            vecino for vecino in self._nbrs[var]
+            if vecino not in assignment
+        ]
+        return sorted(
+            self.domains[var],
+            key=lambda word: self.count_conflicts(var,word,vecinos)
+        )
+
+    def count_conflicts(self, var, word, vecinos):
+        """
+        Return how many values `var` taking `word` rules out among the
+        domains of the unassigned neighbors `vecinos`.
+        """
+        total=0
+        for vecino in vecinos:
+            xOverlap,yOverlap=self._overlap[var,vecino]
+            compatibles=self.bucket(vecino,yOverlap).get(word[xOverlap],())
+            total+=len(self.domains[vecino])-len(compatibles)
+        return total
 
     def select_unassigned_variable(self, assignment):
         """
@@ -205,43 +276,114 @@ class CrosswordCreator():
         degree. If there is a tie, any of the tied variables are acceptable
         return values.
         """
-        usedVariables=[var for var in assignment.keys()]
-        unusedVar= self.crossword.variables.symmetric_difference(set(usedVariables))
-        maxdatosDict={x:len(self.domains[x]) for x in list(unusedVar)}
-        degreeDatosDict={x:len(self.crossword.neighbors(x)) for x in list(unusedVar)}
-        maxDict={key:item for key,item in maxdatosDict.items() if item==max(maxdatosDict.values())}
-        degreeDict={key:item for key,item in degreeDatosDict.items() if item==max(degreeDatosDict.values())}
-        if len(maxdatosDict)>1:
-            if len(degreeDict)>1:
-                return list(degreeDict.keys()).pop()
-            else:
-                return list(degreeDict.keys()).pop()
-        else:
-            return list(maxDict.keys()).pop()
+        return self.most_constrained(
+            self.crossword.variables - assignment.keys()
+        )
+
+    def most_constrained(self, variables):
+        """
+        Return the variable in `variables` with the fewest remaining values,
+        breaking ties by highest degree.
+        """
+        return min(
+            variables,
+            key=lambda var: (len(self.domains[var]), -self._deg[var])
+        )
+
+    def forward_check(self, var, value):
+        """
+        Remove from the domain of each unassigned neighbor of `var` the words
+        that do not agree with `var` taking `value`, as well as `value`
+        itself, since overlapping words must be distinct.
+
+        Return a trail of (variable, previous domain, previous buckets)
+        entries that `undo` can use to restore the domains, or None if some
+        neighbor's domain would end up empty (in which case no domain is
+        modified).
+        """
+        trail=[]
+        for vecino in self._nbrs[var]:
+            if vecino not in self._unassigned:
+                continue
+            xOverlap,yOverlap=self._overlap[var,vecino]
+            compatibles=self.bucket(vecino,yOverlap).get(value[xOverlap],set())
+            compatibles=compatibles-{value}
+            if not compatibles:
+                self.undo(trail)
+                return None
+            # `compatibles` is a subset of the domain, so it is the new domain
+            if len(compatibles)<len(self.domains[vecino]):
+                previo=self.domains[vecino]
+                trail.append((vecino,previo,self.invalidate_buckets(vecino)))
+                self.domains[vecino]=compatibles
+        return trail
+
+    def undo(self, trail):
+        """
+        Restore the domains and letter buckets recorded in `trail`.
+        """
+        for var,previo,buckets in reversed(trail):
+            self.domains[var]=previo
+            self.invalidate_buckets(var)
+            self.buckets.update(buckets)
 
     def backtrack(self, assignment):
-        usedVariables=[var for var in assignment.keys()]
-        
         """
         Using Backtracking Search, take as input a partial assignment for the
         crossword and return a complete assignment if possible to do so.
 
         `assignment` is a mapping from variables (keys) to words (values).
+        The words already in it are kept, and the domains of their
+        neighbors are narrowed to agree with them before searching.
 
         If no assignment is possible, return None.
         """
+        if not self.consistent(assignment):
+            return None
         if self.assignment_complete(assignment):
             return assignment
-        variable = self.select_unassigned_variable(assignment)
-        for value in self.order_domain_values(variable,assignment):
-            assignment[variable]=value
-            if self.consistent(assignment):
-                result=self.backtrack(assignment)
-                if result!=None:
-                    return result
-                return result
+
+        self._unassigned = self.crossword.variables - assignment.keys()
+        inicial=[]
+        for var,word in assignment.items():
+            trail=self.forward_check(var,word)
+            if trail is None:
+                for trail in reversed(inicial):
+                    self.undo(trail)
+                return None
+            inicial.append(trail)
+
+        # Each frame holds a variable, the values still to try for it and the
+        # trail of its current value (None while no value is assigned)
+        variable=self.most_constrained(self._unassigned)
+        stack=[[variable,iter(self.order_domain_values(variable,assignment)),None]]
+        while stack:
+            frame=stack[-1]
+            variable,values,trail=frame
+            if trail is not None:
+                # The current value led to a dead end further down; undo it
+                del assignment[variable]
+                self._unassigned.add(variable)
+                self.undo(trail)
+                frame[2]=None
+            for value in values:
+                trail=self.forward_check(variable,value)
+                if trail is not None:
+                    break
             else:
-                assignment.pop(variable)
+                stack.pop()
+                continue
+            assignment[variable]=value
+            self._unassigned.discard(variable)
+            frame[2]=trail
+            if self.assignment_complete(assignment):
+                return assignment
+            variable=self.most_constrained(self._unassigned)
+            stack.append(
+                [variable,iter(self.order_domain_values(variable,assignment)),None]
+            )
+        for trail in reversed(inicial):
+            self.undo(trail)
         return None
 
 